@@ -0,0 +1,450 @@
+#
+#  IST Chatbot FYP - Shared Chatbot Core
+#  -------------------------------------
+#  Everything that is independent of the HTTP entry point lives here: the
+#  Firestore/model initialization, the knowledge-base matrix and its derived
+#  search structures, the caches, and the answer lookup itself. The deployment
+#  entry points (functions/main.py for Firebase) are thin adapters around
+#  answer_for() and greeting_reply(), so every variant shares the same
+#  optimized similarity kernel instead of drifting apart.
+#
+
+from firebase_admin import initialize_app, firestore
+
+# AI and Data Processing imports
+import numpy as np
+from sentence_transformers import SentenceTransformer
+import functools
+import os
+import pickle
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# SimSIMD provides hand-tuned SIMD kernels (AVX-512/AVX2/NEON/SVE) for exactly
+# our similarity shape and picks the widest instruction set at runtime. Fall
+# back to the plain NumPy matvec if it isn't available in the environment.
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+# hnswlib provides an approximate-nearest-neighbour graph index. The
+# exhaustive scan is O(N) per query, which is fine for a few hundred Q&A pairs
+# but degrades linearly as qna_semantic grows; HNSW keeps lookups ~O(log N).
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# pyahocorasick compiles the greeting keywords into a DFA, so recognition is
+# a single branch-predictable pass over the text - independent of how many
+# salutations the sets grow to - instead of a backtracking regex walk.
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# --- GLOBAL VARIABLES (INITIALIZED ONCE ON COLD START) ---
+
+# Initialize Firebase Admin SDK.
+# Credentials are automatically handled by the Firebase/Google Cloud environment.
+initialize_app()
+db = firestore.client()
+
+class _OnnxEncoder:
+    """SentenceTransformer-compatible encode() over the quantized ONNX export.
+
+    ONNX Runtime fuses MiniLM's MatMul/GELU/LayerNorm chains into a handful of
+    kernels (optimum enables ORT's full graph-optimization level by default)
+    and the dynamically quantized weights run int8 matmuls, so the forward
+    pass is several times faster than eager-mode PyTorch on CPU. Mean pooling
+    and normalization are reproduced here since the export stops at the
+    transformer's last hidden state.
+    """
+
+    def __init__(self, model_dir):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name='model-int8.onnx', provider='CPUExecutionProvider'
+        )
+
+    def encode(self, queries, batch_size=None, normalize_embeddings=False, convert_to_numpy=True):
+        inputs = self.tokenizer(queries, padding=True, truncation=True, return_tensors='np')
+        hidden = np.asarray(self.model(**inputs).last_hidden_state, dtype=np.float32)
+        mask = inputs['attention_mask'][..., None].astype(np.float32)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+
+# Load the sentence encoder. This is a heavy operation, so we do it once when
+# the function instance starts, not for every request. We prefer the int8
+# ONNX export of the same MiniLM model (produced at deploy time by
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 \
+#       --task feature-extraction minilm-onnx/
+#   python -m onnxruntime.quantization.quantize_dynamic \
+#       minilm-onnx/model.onnx minilm-onnx/model-int8.onnx --weight_type QInt8
+# and shipped alongside the function). The fp32 PyTorch model stays as a
+# fallback when the export isn't present.
+model = None
+_ONNX_MODEL_DIR = os.path.join(os.path.dirname(__file__), 'minilm-onnx')
+if os.path.isdir(_ONNX_MODEL_DIR):
+    try:
+        print("Loading ONNX Runtime int8 encoder...")
+        model = _OnnxEncoder(_ONNX_MODEL_DIR)
+        print("ONNX encoder loaded successfully.")
+    except Exception as e:
+        print(f"Could not load ONNX encoder, falling back to PyTorch: {e}")
+        model = None
+if model is None:
+    print("Loading SentenceTransformer model...")
+    model = SentenceTransformer('all-MiniLM-L6-v2')
+    print("Model loaded successfully.")
+
+# Concurrent requests on the same instance each used to pay for a batch-of-1
+# transformer forward pass. A background worker coalesces queries that arrive
+# within a short window into a single model.encode() call, so the encoder's
+# fixed per-call overhead is shared across the batch.
+_ENCODE_QUEUE = queue.Queue()
+_ENCODE_BATCH_WINDOW_SECONDS = 0.005
+_ENCODE_MAX_BATCH = 16
+# Generous ceiling covering queue wait plus a whole batch's forward pass.
+# The first encode after a cold start on the PyTorch fallback can take
+# seconds on a throttled vCPU, and a slow answer beats a timeout error - this
+# only exists so a wedged worker can't block a request past the function's
+# own 60 s deadline.
+_ENCODE_TIMEOUT_SECONDS = 60.0
+
+
+def _encode_worker():
+    while True:
+        batch = [_ENCODE_QUEUE.get()]
+        deadline = time.monotonic() + _ENCODE_BATCH_WINDOW_SECONDS
+        while len(batch) < _ENCODE_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_ENCODE_QUEUE.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        queries = [query for query, _ in batch]
+        try:
+            embeddings = model.encode(
+                queries,
+                batch_size=len(queries),
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+            )
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            continue
+        for (_, future), embedding in zip(batch, embeddings):
+            future.set_result(embedding)
+
+
+threading.Thread(target=_encode_worker, name="encode-batcher", daemon=True).start()
+
+
+def _encode(query: str) -> np.ndarray:
+    """Submit a query to the batching worker and block for its embedding."""
+    future = Future()
+    _ENCODE_QUEUE.put((query, future))
+    return future.result(timeout=_ENCODE_TIMEOUT_SECONDS).astype(np.float32, copy=False)
+
+# Load the knowledge base. The fast path is a snapshot baked into the
+# deployment artifact by prebuild.py: a single np.load with mmap defers
+# page-in until first access and lets the OS share the pages between
+# concurrent function instances, with no per-document Python object churn
+# and no Firestore RPC on the cold-start path. Streaming from Firestore
+# remains the fallback when the snapshot isn't shipped.
+KB_MATRIX = None
+ANSWERS = []
+_KB_SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), 'kb.npy')
+_ANSWERS_SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), 'answers.pkl')
+if os.path.exists(_KB_SNAPSHOT_PATH) and os.path.exists(_ANSWERS_SNAPSHOT_PATH):
+    try:
+        KB_MATRIX = np.load(_KB_SNAPSHOT_PATH, mmap_mode='r')
+        with open(_ANSWERS_SNAPSHOT_PATH, 'rb') as snapshot_file:
+            ANSWERS = pickle.load(snapshot_file)
+        print(f"Knowledge base loaded from snapshot. {len(ANSWERS)} documents loaded.")
+    except Exception as e:
+        KB_MATRIX = None
+        ANSWERS = []
+        print(f"Error loading knowledge base snapshot: {e}")
+
+if KB_MATRIX is None:
+    # Fall back to fetching the entire knowledge base from Firestore and
+    # packing the embeddings into a single contiguous float32 matrix with
+    # L2-normalized rows. With unit-length rows, cosine similarity against a
+    # unit-length query is just one matrix-vector product per request.
+    knowledge_base = []
+    print("Fetching knowledge base from Firestore...")
+    try:
+        docs = db.collection('qna_semantic').stream()
+        for doc in docs:
+            doc_data = doc.to_dict()
+            # Ensure the document has a valid 'embedding' field
+            if 'embedding' in doc_data and doc_data['embedding']:
+                 knowledge_base.append(doc_data)
+        print(f"Knowledge base fetched successfully. {len(knowledge_base)} documents loaded.")
+    except Exception as e:
+        print(f"Error fetching knowledge base: {e}")
+
+    if knowledge_base:
+        KB_MATRIX = np.ascontiguousarray(
+            np.array([doc['embedding'] for doc in knowledge_base], dtype=np.float32)
+        )
+        KB_MATRIX /= np.linalg.norm(KB_MATRIX, axis=1, keepdims=True)
+        ANSWERS = [doc['answer'] for doc in knowledge_base]
+
+# The derived structures below are built from a full-precision view of the
+# matrix, regardless of whether it came from the fp16 snapshot or Firestore.
+_KB_F32 = None
+if KB_MATRIX is not None:
+    _KB_F32 = np.ascontiguousarray(KB_MATRIX, dtype=np.float32)
+
+# Symmetric per-row int8 quantization of the normalized KB rows. This shrinks
+# the working set 4x versus fp32, and SimSIMD's int8 dot kernel can use
+# VNNI/UDOT instructions that do many more multiply-accumulates per cycle.
+# Cosine is recovered by rescaling the integer dot products; the rows and the
+# query are already unit-length, so only the quantization scales are needed.
+KB_INT8 = None
+KB_SCALES = None
+if _KB_F32 is not None and simsimd is not None:
+    KB_SCALES = np.max(np.abs(_KB_F32), axis=1) / 127.0
+    KB_INT8 = np.ascontiguousarray(
+        np.round(_KB_F32 / KB_SCALES[:, None]).astype(np.int8)
+    )
+
+# Once the knowledge base is large enough that an exhaustive scan hurts,
+# build an HNSW graph over it at cold start and answer queries with an
+# approximate nearest-neighbour lookup instead of the full matvec. Below the
+# threshold the brute-force scan is both exact and already fast, so the index
+# isn't worth its build time and memory.
+KB_ANN = None
+_ANN_MIN_ROWS = 1024
+if hnswlib is not None and _KB_F32 is not None and len(_KB_F32) >= _ANN_MIN_ROWS:
+    print("Building HNSW index over the knowledge base...")
+    KB_ANN = hnswlib.Index(space='cosine', dim=_KB_F32.shape[1])
+    KB_ANN.init_index(max_elements=len(_KB_F32), ef_construction=200, M=16)
+    KB_ANN.add_items(_KB_F32, np.arange(len(_KB_F32)))
+    KB_ANN.set_ef(50)
+    print("HNSW index built successfully.")
+
+# Keep the full-precision matrix in float16 from here on: cosine on unit
+# vectors is comfortably within fp16 range, and halving the bytes halves both
+# the per-instance RAM and the DRAM traffic of the fallback matvec. The rows
+# are upcast back to fp32 at multiply time to keep the accumulation accurate.
+# (The snapshot is already stored as fp16, so this is a no-op for that path.)
+if KB_MATRIX is not None and KB_MATRIX.dtype != np.float16:
+    KB_MATRIX = KB_MATRIX.astype(np.float16)
+del _KB_F32
+
+
+# Simple conversational keywords and their matching patterns. Compiled once
+# here so the per-request path doesn't rebuild and recompile a regex per call.
+greetings = {'hi', 'hello', 'hey', 'hy', 'greetings', 'yo'}
+thanks = {'thanks', 'thank you', 'thx'}
+_GREET_RE = re.compile(r"[\w\s]*\b(" + "|".join(greetings) + r")\b[\w\s]*!?")
+_THANKS_RE = re.compile(r"[\w\s]*\b(" + "|".join(thanks) + r")\b[\w\s]*!?")
+
+
+def _build_automaton(words):
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, word)
+    automaton.make_automaton()
+    return automaton
+
+
+_GREET_AC = None
+_THANKS_AC = None
+if ahocorasick is not None:
+    _GREET_AC = _build_automaton(greetings)
+    _THANKS_AC = _build_automaton(thanks)
+
+
+def _automaton_hit(automaton, text: str) -> bool:
+    """True if the automaton finds any keyword spanning whole words in text.
+
+    This is only a prefilter: a hit says a greeting word occurs somewhere,
+    not that the whole message is a greeting ("hi, fee structure?" contains
+    "hi" but is a real question). Callers must confirm hits with the full
+    pattern before replying.
+    """
+    for end_index, word in automaton.iter(text):
+        start_index = end_index - len(word) + 1
+        before = text[start_index - 1] if start_index > 0 else ' '
+        after = text[end_index + 1] if end_index + 1 < len(text) else ' '
+        if not (before.isalnum() or before == '_') and not (after.isalnum() or after == '_'):
+            return True
+    return False
+
+
+def greeting_reply(q_low: str):
+    """Return a canned reply for greetings/thanks, or None for real questions.
+
+    Expects the already-lowercased query; callers normalize once so the hot
+    path doesn't re-allocate a lowered copy per layer.
+    """
+    # Greetings are always short, so skip the whole layer for long queries.
+    if len(q_low) > 32:
+        return None
+    # Most greetings are a single word ("hi", "thanks"), so try a plain set
+    # lookup first and only fall back to the regexes for multi-word messages
+    # like "hello there".
+    q_bare = q_low.rstrip('!.? ')
+    if _GREET_AC is not None:
+        # The automatons act as a cheap reject filter: no keyword in the text
+        # means the regexes never run. Hits are still confirmed with the same
+        # fullmatch as the fallback path, so a greeting word buried inside a
+        # real question ("hi, fee structure?") goes to semantic search either
+        # way, regardless of whether pyahocorasick is installed.
+        if q_bare in greetings or (_automaton_hit(_GREET_AC, q_low) and _GREET_RE.fullmatch(q_low)):
+            return "Hello! How can I assist you with IST today?"
+        if q_bare in thanks or (_automaton_hit(_THANKS_AC, q_low) and _THANKS_RE.fullmatch(q_low)):
+            return "You're welcome! Is there anything else I can help with?"
+        return None
+    if q_bare in greetings or _GREET_RE.fullmatch(q_low):
+        return "Hello! How can I assist you with IST today?"
+    if q_bare in thanks or _THANKS_RE.fullmatch(q_low):
+        return "You're welcome! Is there anything else I can help with?"
+    return None
+
+
+# Identifier-style queries ("BSCS-2021-045", "room 302") are exact lookups,
+# not semantic questions - running them through the encoder and the KB scan
+# pays for the two heaviest steps of the pipeline to do a fuzzy match on a
+# key. Recognize them with cheap anchored regexes and answer straight from
+# the keyed 'records' collection instead.
+_ID_RE = re.compile(r'^[A-Z]{2,4}-\d{4}-\d{2,5}$')
+_ROOM_RE = re.compile(r'^room\s*(\d+)$', re.IGNORECASE)
+
+
+def record_reply(q_low: str):
+    """Return the keyed-record answer for identifier queries, or None."""
+    key = None
+    query_upper = q_low.upper()
+    if _ID_RE.match(query_upper):
+        key = query_upper
+    else:
+        room_match = _ROOM_RE.match(q_low)
+        if room_match:
+            key = f"ROOM-{room_match.group(1)}"
+    if key is None:
+        return None
+    try:
+        record = db.collection('records').document(key).get()
+    except Exception as e:
+        print(f"Error looking up record '{key}': {e}")
+        return None
+    if record.exists:
+        return record.to_dict().get('answer')
+    # Unknown identifier: fall through to the semantic layer rather than
+    # answering with nothing.
+    return None
+
+
+# Users re-ask the same handful of questions ("fee structure", "admissions
+# deadline") constantly. Two layers of caching exploit that:
+#   - an LRU cache on the exact (lowercased) query text, which skips the
+#     encoder entirely for verbatim repeats, and
+#   - a small semantic cache of recent (embedding, answer) pairs, which skips
+#     the full knowledge-base scan for near-identical rephrasings.
+# Entries carry an expiry so a refreshed knowledge base can't be shadowed by
+# stale cached answers forever.
+_SEM_CACHE = deque(maxlen=256)
+# Requests run concurrently per instance (the encode batcher exists precisely
+# for that), and a deque raises RuntimeError if another thread appends while
+# one is iterating - so every read takes a snapshot under this lock and every
+# append happens under it too.
+_SEM_CACHE_LOCK = threading.Lock()
+_SEM_CACHE_THRESHOLD = 0.97
+_SEM_CACHE_TTL_SECONDS = 3600.0
+
+_FALLBACK_ANSWER = "I'm sorry, I don't seem to have the answer to that. Please try rephrasing your question or visit the official IST website for more information."
+
+# Row-tile size for the fallback matvec. 64 rows x 384 fp32 columns is ~96 KB,
+# comfortably inside L2, so the upcast buffer is reused from cache while the
+# fp16 rows stream through DRAM exactly once.
+_MATVEC_TILE_ROWS = 64
+
+
+def _tiled_matvec(matrix, vector):
+    """Multiply the fp16 KB matrix by a query, upcasting one row tile at a time.
+
+    A whole-matrix .astype(np.float32) materializes a full-size second copy of
+    the KB per request; tiling bounds the upcast scratch to one small block
+    that stays cache-resident, while BLAS still handles the per-tile FMAs.
+    """
+    similarities = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), _MATVEC_TILE_ROWS):
+        tile = matrix[start:start + _MATVEC_TILE_ROWS].astype(np.float32)
+        similarities[start:start + _MATVEC_TILE_ROWS] = tile @ vector
+    return similarities
+
+
+@functools.lru_cache(maxsize=1024)
+def _answer_for(query: str) -> tuple:
+    """Encode the query and return the best (answer, score) pair from the KB."""
+    query_embedding = _encode(query)
+
+    # Near-duplicate of something we answered recently? Serve the cached
+    # answer instead of scanning the whole knowledge base again.
+    now = time.monotonic()
+    with _SEM_CACHE_LOCK:
+        cache_snapshot = list(_SEM_CACHE)
+    for cached_embedding, cached_answer, cached_score, expires_at in cache_snapshot:
+        if expires_at > now and float(np.dot(cached_embedding, query_embedding)) >= _SEM_CACHE_THRESHOLD:
+            return cached_answer, cached_score
+
+    if KB_ANN is not None:
+        # Large knowledge base: approximate nearest-neighbour lookup.
+        labels, distances = KB_ANN.knn_query(query_embedding.reshape(1, -1), k=1)
+        best_match_index = int(labels[0][0])
+        best_match_score = 1.0 - float(distances[0][0])
+    else:
+        # Both sides are unit vectors, so one pass over the matrix gives the
+        # cosine similarity against every knowledge-base entry at once.
+        if KB_INT8 is not None:
+            q_scale = float(np.max(np.abs(query_embedding))) / 127.0
+            query_int8 = np.round(query_embedding / q_scale).astype(np.int8)
+            dots = np.asarray(
+                simsimd.cdist(query_int8.reshape(1, -1), KB_INT8, metric="dot")
+            )[0]
+            similarities = dots * (KB_SCALES * q_scale)
+        else:
+            similarities = _tiled_matvec(KB_MATRIX, query_embedding)
+
+        best_match_index = int(similarities.argmax())
+        best_match_score = float(similarities[best_match_index])
+
+    best_match_answer = _FALLBACK_ANSWER
+    if best_match_score > 0.60: # Confidence threshold
+        best_match_answer = ANSWERS[best_match_index]
+
+    with _SEM_CACHE_LOCK:
+        _SEM_CACHE.append((query_embedding, best_match_answer, best_match_score, now + _SEM_CACHE_TTL_SECONDS))
+    return best_match_answer, best_match_score
+
+
+def answer_for(q_low: str) -> dict:
+    """Answer a user question; raises if the knowledge base isn't loaded.
+
+    Expects the already-lowercased query so the exact-text cache key is built
+    without another pass over the string.
+    """
+    if KB_MATRIX is None:
+        raise RuntimeError("Knowledge base is not loaded.")
+    best_match_answer, best_match_score = _answer_for(q_low)
+    return {"answer": best_match_answer, "score": best_match_score}
@@ -1,52 +1,33 @@
 #
 #  IST Chatbot FYP - Semantic Search Cloud Function (Firebase Version)
 #  -------------------------------------------------------------------
-#  This is the main Python code for the backend "brain" of the chatbot.
-#  It's designed to be deployed using the Firebase CLI.
+#  This is the Firebase entry point for the chatbot backend. All of the
+#  model/knowledge-base initialization and the answer lookup live in
+#  chatbot_core.py; this file only handles HTTP concerns (CORS, request
+#  parsing, response serialization) so other entry points can share the
+#  exact same search kernel.
 #
 
 # Firebase and Google Cloud imports
 from firebase_functions import https_fn
 from firebase_functions.options import set_global_options
-from firebase_admin import initialize_app, firestore
 
-# AI and Data Processing imports
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-import re
+import orjson
+
+import chatbot_core
 
 # For cost control and performance management.
 # This sets a global limit of 10 concurrent instances for all functions.
 set_global_options(max_instances=10)
 
-# --- GLOBAL VARIABLES (INITIALIZED ONCE ON COLD START) ---
-
-# Initialize Firebase Admin SDK.
-# Credentials are automatically handled by the Firebase/Google Cloud environment.
-initialize_app()
-db = firestore.client()
-
-# Load the Sentence Transformer model. This is a heavy operation, so we do it
-# once when the function instance starts, not for every request.
-print("Loading SentenceTransformer model...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print("Model loaded successfully.")
-
-# Pre-fetch the entire knowledge base from Firestore and store it in memory.
-# This makes the search much faster as we don't have to query the database on every request.
-knowledge_base = []
-print("Fetching knowledge base from Firestore...")
-try:
-    docs = db.collection('qna_semantic').stream()
-    for doc in docs:
-        doc_data = doc.to_dict()
-        # Ensure the document has a valid 'embedding' field
-        if 'embedding' in doc_data and doc_data['embedding']:
-             knowledge_base.append(doc_data)
-    print(f"Knowledge base fetched successfully. {len(knowledge_base)} documents loaded.")
-except Exception as e:
-    print(f"Error fetching knowledge base: {e}")
+
+def _json_response(payload: dict, headers: dict, status: int = 200) -> https_fn.Response:
+    """Serialize a payload with orjson and attach the JSON content type."""
+    return https_fn.Response(
+        orjson.dumps(payload),
+        status=status,
+        headers={**headers, 'Content-Type': 'application/json'},
+    )
 
 
 # --- MAIN CLOUD FUNCTION ---
@@ -70,50 +51,34 @@ def find_answer(req: https_fn.Request) -> https_fn.Response:
         }
         return ("", 204, cors_headers)
 
-    # Get the user's question from the request body
-    try:
-        request_json = req.get_json(silent=True)
-    except Exception as e:
-        print(f"Error parsing JSON: {e}")
-        return https_fn.Response(body="Invalid JSON format.", status=400, headers=headers)
-
+    # Get the user's question from the request body. silent=True already
+    # swallows malformed JSON and returns None, so no try/except is needed.
+    request_json = req.get_json(silent=True)
     if not request_json or 'question' not in request_json:
         return https_fn.Response(body="Invalid request. 'question' field is missing.", status=400, headers=headers)
 
+    # Strip and lowercase exactly once; every layer below works on q_low, so
+    # the hot path doesn't re-allocate a normalized copy per check.
     user_query = request_json['question'].strip()
+    q_low = user_query.lower()
 
     if not user_query:
-        return https_fn.Response(body="Please ask a question.", status=200, headers=headers)
+        return _json_response({"answer": "Please ask a question."}, headers)
 
     # --- Layer 1: Conversational Greetings ---
-    greetings = {'hi', 'hello', 'hey', 'hy', 'greetings', 'yo'}
-    thanks = {'thanks', 'thank you', 'thx'}
-    
-    # Use regex to check for simple greetings, ignoring punctuation
-    if re.fullmatch(r"[\w\s]*\b(" + "|".join(greetings) + r")\b[\w\s]*!?", user_query.lower()):
-        return https_fn.Response("Hello! How can I assist you with IST today?", status=200, headers=headers)
-    if re.fullmatch(r"[\w\s]*\b(" + "|".join(thanks) + r")\b[\w\s]*!?", user_query.lower()):
-        return https_fn.Response("You're welcome! Is there anything else I can help with?", status=200, headers=headers)
+    reply = chatbot_core.greeting_reply(q_low)
+    if reply is not None:
+        return _json_response({"answer": reply}, headers)
+
+    # --- Layer 1.5: Keyed record lookups ---
+    # Identifier-style queries skip the encoder and the KB scan entirely.
+    reply = chatbot_core.record_reply(q_low)
+    if reply is not None:
+        return _json_response({"answer": reply}, headers)
 
     # --- Layer 2: Semantic Search ---
     try:
-        if not knowledge_base:
-            raise RuntimeError("Knowledge base is not loaded.")
-
-        query_embedding = model.encode([user_query])[0]
-        db_embeddings = [doc['embedding'] for doc in knowledge_base]
-        
-        similarities = cosine_similarity([query_embedding], db_embeddings)[0]
-        best_match_index = np.argmax(similarities)
-        best_match_score = similarities[best_match_index]
-
-        best_match_answer = "I'm sorry, I don't seem to have the answer to that. Please try rephrasing your question or visit the official IST website for more information."
-
-        if best_match_score > 0.60: # Confidence threshold
-            best_match_answer = knowledge_base[best_match_index]['answer']
-        
-        return https_fn.Response(best_match_answer, status=200, headers=headers)
-
+        return _json_response(chatbot_core.answer_for(q_low), headers)
     except Exception as e:
         print(f"An error occurred during semantic search: {e}")
         return https_fn.Response("An internal error occurred. Could not process the request.", status=500, headers=headers)
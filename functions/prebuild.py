@@ -0,0 +1,55 @@
+#
+#  IST Chatbot FYP - Knowledge-Base Snapshot Builder
+#  -------------------------------------------------
+#  Run this locally (or as a deploy step) before `firebase deploy` to bake a
+#  snapshot of the qna_semantic collection into the deployment artifact:
+#
+#      python prebuild.py
+#
+#  It writes kb.npy (the L2-normalized embedding matrix, stored as float16)
+#  and answers.pkl (the parallel answer list) next to main.py. When those
+#  files are shipped with the function, cold start loads the whole knowledge
+#  base with a single memory-mapped np.load instead of streaming every
+#  document from Firestore and rebuilding the matrix from Python lists.
+#
+
+import os
+import pickle
+
+import numpy as np
+from firebase_admin import initialize_app, firestore
+
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    initialize_app()
+    db = firestore.client()
+
+    print("Fetching knowledge base from Firestore...")
+    embeddings = []
+    answers = []
+    for doc in db.collection('qna_semantic').stream():
+        doc_data = doc.to_dict()
+        # Ensure the document has a valid 'embedding' field
+        if 'embedding' in doc_data and doc_data['embedding']:
+            embeddings.append(doc_data['embedding'])
+            answers.append(doc_data['answer'])
+    print(f"Fetched {len(answers)} documents.")
+
+    if not answers:
+        raise SystemExit("No documents with embeddings found; nothing to snapshot.")
+
+    kb_matrix = np.ascontiguousarray(np.array(embeddings, dtype=np.float32))
+    kb_matrix /= np.linalg.norm(kb_matrix, axis=1, keepdims=True)
+
+    # fp16 halves the snapshot on disk and in resident memory; main.py upcasts
+    # to fp32 wherever full precision is needed.
+    np.save(os.path.join(OUTPUT_DIR, 'kb.npy'), kb_matrix.astype(np.float16))
+    with open(os.path.join(OUTPUT_DIR, 'answers.pkl'), 'wb') as snapshot_file:
+        pickle.dump(answers, snapshot_file)
+    print(f"Snapshot written to {OUTPUT_DIR} (kb.npy, answers.pkl).")
+
+
+if __name__ == '__main__':
+    main()